@@ -1,7 +1,12 @@
+import os
 import sys
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel
 from PyQt5.QtCore import Qt
-import master_core
+
+_AUDIO_EXTS = frozenset({'.mp3', '.wav', '.flac'})
+
+def _is_audio_file(path):
+    return os.path.splitext(path)[1].lower() in _AUDIO_EXTS
 
 class AudioDragDropWidget(QWidget):
     def __init__(self):
@@ -21,13 +26,13 @@ class AudioDragDropWidget(QWidget):
         self.setLayout(layout)
     
     def dragEnterEvent(self, event):
-        if event.mimeData().hasUrls():
+        if any(_is_audio_file(u.toLocalFile()) for u in event.mimeData().urls()):
             event.accept()
         else:
             event.ignore()
     
     def dropEvent(self, event):
-        files = [u.toLocalFile() for u in event.mimeData().urls()]
+        files = [p for p in (u.toLocalFile() for u in event.mimeData().urls()) if _is_audio_file(p)]
         for file_path in files:
             self.label.setText(f'File dropped: {file_path}')
             # Here, you would call your plot function with the dropped file path
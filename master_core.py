@@ -1,21 +1,49 @@
 import librosa
 import numpy as np
+import soundfile as sf
 import os
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import matplotlib.cm as cm
+from matplotlib.collections import PolyCollection
 
+from mutagen import MutagenError
 from mutagen.mp3 import MP3
 from mutagen.easyid3 import EasyID3
 
-def try_mp3_tags(file_path):
+log = logging.getLogger(__name__)
+
+try:
+  # optional SIMD RMS kernel, see block_mean_squares
+  import numpy_rms
+except ImportError:
+  numpy_rms = None
+
+@functools.lru_cache(maxsize=512)
+def _read_mp3_tags_cached(abs_path, mtime_ns):
   try:
     # if there is metadata
-    audio = MP3(file_path, ID3=EasyID3)
+    audio = MP3(abs_path, ID3=EasyID3)
     return audio
-  except Exception as e:
-    print(f"Error reading ID3 tags: {e}")
+  except MutagenError as e:
+    # mutagen wraps I/O errors too; those may be transient, so raise them
+    # past the cache instead of remembering None for this mtime
+    if isinstance(e.__cause__ or e.__context__, OSError):
+      raise
+    log.debug("ID3 read failed for %s: %s", abs_path, e)
+    return None
+
+def try_mp3_tags(file_path):
+  # keyed on mtime as well, so retagging a file isn't served stale
+  try:
+    mtime_ns = os.stat(file_path).st_mtime_ns
+    return _read_mp3_tags_cached(os.path.abspath(file_path), mtime_ns)
+  except (MutagenError, OSError) as e:
+    log.debug("ID3 read failed for %s: %s", file_path, e)
     return None
 
 def read_mp3_tags(file_path):
@@ -24,38 +52,254 @@ def read_mp3_tags(file_path):
     print(f"{audio['artist'][0]} - {audio['title'][0]}")
   else:
     print(f"File name: {os.path.basename(file_path)}")
+
+# formats libsndfile decodes directly, skipping librosa's fallback chain
+_SOUNDFILE_EXTS = frozenset({'.wav', '.flac'})
+
+def load_audio(file_path):
+  """Decode an audio file to a mono float32 signal at its native sample rate.
+
+  Args:
+      file_path (str): Path to the audio file.
+
+  Returns:
+      tuple: (y, sr), the mono time series and its sampling rate.
+  """
+  if os.path.splitext(file_path)[1].lower() in _SOUNDFILE_EXTS:
+    y, sr = sf.read(file_path, dtype='float32', always_2d=False)
+    if y.ndim == 2:
+      y = y.mean(axis=1, dtype=np.float32)
+    return y, sr
+  # no resampling, the analysis runs at whatever rate the file has
+  return librosa.load(file_path, sr=None, mono=True)
+
+def rolling_rms(y, window_samples, hop_samples):
+  """Rolling RMS of a mono signal.
+
+  Same result as librosa.feature.rms(y=y, frame_length=window_samples,
+  hop_length=hop_samples, center=False), but computed in one pass from a
+  running sum of squares instead of framing the signal. When the window is a
+  whole number of hops it works from hop-sized block mean squares instead
+  (see block_mean_squares).
+
+  Args:
+      y (np.ndarray): Mono audio time series.
+      window_samples (int): Length of each RMS window in samples.
+      hop_samples (int): Hop between consecutive windows in samples.
+
+  Returns:
+      np.ndarray: RMS values, shaped (1, n_frames) like librosa.feature.rms.
+  """
+  y = np.ascontiguousarray(y, dtype=np.float32)
+  # a track shorter than one window still gets a single frame
+  window_samples = min(window_samples, len(y))
+  if window_samples % hop_samples == 0:
+    # every window is then exactly window/hop consecutive hop-sized blocks
+    return rolling_rms_of_mean_squares(block_mean_squares(y, hop_samples), window_samples // hop_samples, 1)
+  return rolling_rms_of_mean_squares(np.square(y, dtype=np.float64), window_samples, hop_samples)
+
+def rolling_rms_of_mean_squares(mean_squares, window, hop):
+  """Rolling RMS from per-sample squares, or from mean squares of equal-length blocks.
+
+  Args:
+      mean_squares (np.ndarray): Squared samples, or mean squares of consecutive blocks.
+      window (int): Length of each RMS window in entries of mean_squares.
+      hop (int): Hop between consecutive windows in entries of mean_squares.
+
+  Returns:
+      np.ndarray: RMS values as float32, shaped (1, n_frames).
+  """
+  window = min(window, len(mean_squares))
+  # each window's sum is the difference of two running-sum entries;
+  # accumulate in float64, float32 drifts badly over millions of samples,
+  # and clamp so rounding on silent stretches can't go negative
+  cumulative = np.concatenate(([0.], np.cumsum(mean_squares, dtype=np.float64)))
+  starts = np.arange(0, len(mean_squares) - window + 1, hop)
+  return np.sqrt(np.maximum(cumulative[starts + window] - cumulative[starts], 0.) / window).astype(np.float32)[np.newaxis, :]
+
+def block_mean_squares(y, step):
+  # mean of y**2 over consecutive blocks of step samples, a trailing partial
+  # block is dropped; unlike y[::step] this doesn't alias anything to DC.
+  # squares stay float32, only the short array of block means is float64
+  n_blocks = len(y) // step
+  if numpy_rms is not None:
+    # the SIMD kernel gives per-block RMS, squaring that is the block mean square
+    blocks = numpy_rms.rms(np.ascontiguousarray(y[:n_blocks * step], dtype=np.float32), window_size=step)
+    return np.square(blocks, dtype=np.float64)
+  return np.square(y[:n_blocks * step]).reshape(n_blocks, step).mean(axis=1, dtype=np.float64)
+
+@functools.lru_cache(maxsize=32)
+def frame_centre_times(n_frames, hop, window):
+  # frame i of a rolling RMS covers i * hop to i * hop + window seconds, and is
+  # plotted at its centre like librosa's centred frames used to be.
+  # the array is cached and shared between every file with the same frame count,
+  # hop and window, so it's read-only.
+  times = np.arange(n_frames, dtype=np.float32) * np.float32(hop) + np.float32(window / 2)
+  times.flags.writeable = False
+  return times
     
+def power_collection(times, rms, hop, cmap, norm):
+  # one filled quad per frame, from times[i] to times[i] + hop at height rms[i],
+  # all in a single artist that also doubles as the colorbar mappable;
+  # the last frame is drawn too, short tracks may only have the one
+  t0, r = times, rms
+  t1 = times + np.float32(hop)
+  floor = np.zeros_like(r)
+  quads = np.stack([np.stack([t0, t0, t1, t1], axis=1), np.stack([floor, r, r, floor], axis=1)], axis=-1)
+  return PolyCollection(quads, array=r, cmap=cmap, norm=norm, edgecolors='none')
+
+def _spaced_blocks(f, window_samples, hop_samples):
+  # windows shorter than the hop: read one window, then seek over the gap
+  # to the next window start (SoundFile.blocks can't skip ahead)
+  while True:
+    block = f.read(window_samples, dtype='float32')
+    if not len(block):
+      return
+    yield block
+    gap = hop_samples - window_samples
+    if f.tell() + gap >= f.frames:
+      return
+    f.seek(gap, sf.SEEK_CUR)
+
+# sample rate the rolling RMS in AudioFile is computed at, in Hz
+RMS_ANALYSIS_RATE = 4000
+
 class AudioFile:
   def __init__(self, file_path):
     self.file_path = file_path
-    self.y, self.sr = librosa.load(file_path)
-    # load automatically normalises everything to [-1.0, 1.0]
+    self._rms_cache = {}
+
+  def __getstate__(self):
+    # the decoded signal dwarfs everything else and is decoded again on
+    # demand, so don't ship it back from worker processes
+    state = self.__dict__.copy()
+    state.pop('_decoded', None)
+    return state
+
+  @functools.cached_property
+  def _decoded(self):
+    # only decode once something actually needs the samples
+    y, sr = load_audio(self.file_path)
+    # loading normalises everything to [-1.0, 1.0]
     # and that's alright
-    self.y_mono = librosa.to_mono(self.y)
-    self.max_amplitude = np.max(np.abs(self.y_mono))
-    self.avg_amplitude = np.mean(np.abs(self.y_mono))
+    # keep it float32 so nothing downstream silently promotes to float64
+    return np.ascontiguousarray(y, dtype=np.float32), sr
+
+  @functools.cached_property
+  def _info(self):
+    # sample rate and duration from the header alone; loading keeps the
+    # native rate, so this matches the decoded signal
+    try:
+      info = sf.info(self.file_path)
+      return info.samplerate, info.duration
+    except RuntimeError:
+      # libsndfile can't open it (e.g. MP3 on older builds), decode instead
+      y, sr = self._decoded
+      return sr, len(y) / sr
+
+  @property
+  def y(self):
+    return self._decoded[0]
+
+  @property
+  def sr(self):
+    return self._info[0]
+
+  @property
+  def duration(self):
+    return self._info[1]
+
+  @functools.cached_property
+  def _amplitude_stats(self):
+    # both reductions share a single |y| pass
+    abs_y = np.abs(self.y)
+    return abs_y.max(), abs_y.mean()
+
+  @property
+  def max_amplitude(self):
+    return self._amplitude_stats[0]
+
+  @property
+  def avg_amplitude(self):
+    return self._amplitude_stats[1]
   
   def get_amplitudes(self):
     return self.max_amplitude, self.avg_amplitude
   
+  def _frame_lengths(self, window, hop):
+    # window and hop in samples, rounded down to whole blocks of step samples
+    # (see get_energy_levels_over_time); stream_rms uses the same lengths so
+    # both paths measure exactly the same stretches of the track
+    step = max(1, self.sr // RMS_ANALYSIS_RATE)
+    window_samples = int(window * self.sr) // step * step
+    hop_samples = int(hop * self.sr) // step * step
+    if window_samples <= 0 or hop_samples <= 0:
+      raise ValueError(f"window ({window} s) and hop ({hop} s) must each span at least {step} samples")
+    return window_samples, hop_samples, step
+
   def get_energy_levels_over_time(self, window = 10, hop = 2):
-    """_summary_
+    """Rolling RMS of the track, cached per (window, hop).
 
     Args:
         window (int, optional): Length of rolling RMS window in seconds. Defaults to 10.
         hop (int, optional): Length of window hop in seconds. Defaults to 2.
+
+    Returns:
+        np.ndarray: RMS values, shaped (1, n_frames).
     """
-    # check if the window and hop are the same as before    
-    if (not hasattr(self, 'window')) or ((self.window != window) or (self.hop != hop)):
-      self.window, self.hop = window, hop
-      # only calculate if not already calculated
-      if not hasattr(self, 'rms_array'):
-        # window and hop are in seconds
-        window_samples = window * self.sr
-        hop_samples = hop * self.sr
-        
-        # Calculate RMS over the rolling windows
-        self.rms_array = librosa.feature.rms(y=self.y, frame_length=window_samples, hop_length=hop_samples)
+    key = (window, hop)
+    if key not in self._rms_cache:
+      window_samples, hop_samples, step = self._frame_lengths(window, hop)
+      # reduce the signal to mean squares over blocks of step samples, about
+      # RMS_ANALYSIS_RATE per second; window and hop are whole blocks
+      mean_squares = block_mean_squares(self.y, step)
+      
+      # Calculate RMS over the rolling windows
+      rms_array = rolling_rms_of_mean_squares(mean_squares, window_samples // step, hop_samples // step)
+      self._rms_cache[key] = rms_array, frame_centre_times(rms_array.shape[1], hop_samples / self.sr, min(window_samples / self.sr, self.duration))
+    # the last requested parameters are what gets plotted
+    self.window, self.hop = key
+    self.rms_array, self._times = self._rms_cache[key]
+    return self.rms_array
+
+  def stream_rms(self, window = 10, hop = 2):
+    """Rolling RMS read block by block from disk, without decoding the whole file.
+
+    Fills the same cache as get_energy_levels_over_time, so plotting afterwards
+    doesn't decode the file either.
+
+    Args:
+        window (int, optional): Length of rolling RMS window in seconds. Defaults to 10.
+        hop (int, optional): Length of window hop in seconds. Defaults to 2.
+
+    Returns:
+        np.ndarray: RMS values, shaped (1, n_frames).
+    """
+    key = (window, hop)
+    if key not in self._rms_cache:
+      window_samples, hop_samples, _ = self._frame_lengths(window, hop)
+      with sf.SoundFile(self.file_path) as f:
+        if window_samples >= hop_samples:
+          # consecutive blocks start hop_samples apart, only the overlap is kept in memory
+          blocks = f.blocks(blocksize=window_samples, overlap=window_samples - hop_samples, dtype='float32')
+        else:
+          blocks = _spaced_blocks(f, window_samples, hop_samples)
+        rms = []
+        for block in blocks:
+          # a trailing partial window only counts if the track is shorter than one window
+          if len(block) < window_samples and rms:
+            break
+          if block.ndim == 2:
+            block = block.mean(axis=1, dtype=np.float32)
+          rms.append(np.sqrt(np.mean(np.square(block, dtype=np.float64))))
+      rms_array = np.array(rms, dtype=np.float32)[np.newaxis, :]
+      self._rms_cache[key] = rms_array, frame_centre_times(rms_array.shape[1], hop_samples / self.sr, min(window_samples / self.sr, self.duration))
+    self.window, self.hop = key
+    self.rms_array, self._times = self._rms_cache[key]
+    return self.rms_array
+
+  def _get_times(self):
+    return self._times
     
   def plot_energy_levels_over_time(self, display='window'):  
     """_summary_
@@ -69,7 +313,7 @@ class AudioFile:
       self.get_energy_levels_over_time()
 
     # Convert frame indices to time
-    times = librosa.frames_to_time(np.arange(self.rms_array.shape[1]), sr=self.sr, hop_length=self.hop*self.sr)
+    times = self._get_times()
     
     
     # Normalize RMS for color mapping
@@ -91,13 +335,12 @@ class AudioFile:
     if display == 'window':
       fig, ax = plt.subplots(figsize=(10, 4))
       ax.set_ylim(0., maxpower)
-      for i in range(len(times)-1):
-          ax.fill_between(times[i:i+2], 0, self.rms_array[0][i], color=cmap(norm(self.rms_array[0][i])), edgecolor='none')
+      power = power_collection(times, self.rms_array[0], self.hop, cmap, norm)
+      ax.add_collection(power)
+      ax.autoscale_view()
       
       # Adding a colorbar to indicate the scale of RMS values
-      sm = cm.ScalarMappable(cmap=cmap, norm=norm)
-      sm.set_array([])
-      cbar = plt.colorbar(sm, ax=ax, label='RMS Power')
+      cbar = plt.colorbar(power, ax=ax, label='RMS Power')
       # cbar.ax.set_yticklabels([f"{x-60.0:.0f} dBFS" for x in cbar.get_ticks()])  # Adjust labels to show true dBFS values
       
       ax.set_ylabel('Power')
@@ -113,30 +356,35 @@ class AudioFile:
 def analyze_track_librosa(file_path):
   # Load the audio file
   # y is the audio time series and sr is the sampling rate
-  y, sr = librosa.load(file_path)
+  y, sr = load_audio(file_path)
+  return analyze_signal(y)
+
+def analyze_signal(y):
+  # max amplitude, average amplitude and average power in dBFS of an
+  # already decoded signal, so callers holding the samples don't load twice
 
   # Calculate the maximum amplitude
-  # Librosa's load function normalizes the audio to [-1, 1], so we scale it back
-  max_amplitude = np.max(np.abs(y))
+  # loading normalises everything to [-1.0, 1.0], so ref=1.0 below is full scale
+  abs_y = np.abs(y)
+  max_amplitude = abs_y.max()
   # Average amplitude
-  avg_amplitude = np.mean(np.abs(y))
+  avg_amplitude = abs_y.mean()
   
   # Convert max amplitude to dBFS
   max_amplitude_dBFS = librosa.amplitude_to_db([max_amplitude], ref=1.0)
   avg_amplitude_dBFS = librosa.amplitude_to_db([avg_amplitude], ref=1.0)
 
   # Calculate RMS in dB
-  S, phase = librosa.magphase(librosa.stft(y))
-  rms_stft = librosa.feature.rms(S=S)
+  # straight from the time series; going through an STFT first only
+  # changes the windowing and costs a full complex spectrogram
   rms = librosa.feature.rms(y=y)
-  avg_power_dBFS_stft = 20 * np.log10(np.mean(rms_stft))
-  avg_power_dBFS = 20 * np.log10(np.mean(rms))
+  avg_power_dBFS = librosa.amplitude_to_db([np.mean(rms)], ref=1.0)
 
-  return max_amplitude_dBFS[0], avg_amplitude_dBFS[0], avg_power_dBFS, avg_power_dBFS_stft
+  return max_amplitude_dBFS[0], avg_amplitude_dBFS[0], avg_power_dBFS[0]
 
 def plot_macro_time_power_graph(file_path):
     # Load the audio file
-    y, sr = librosa.load(file_path, mono=True)
+    y, sr = load_audio(file_path)
 
     # Define the window and hop length
     # 10 seconds window and 1 second hop
@@ -144,10 +392,10 @@ def plot_macro_time_power_graph(file_path):
     hop_length = int(sr * 1)  # 1 second in samples
 
     # Calculate RMS over the rolling windows
-    rms = librosa.feature.rms(y=y, frame_length=window_length, hop_length=hop_length)
+    rms = rolling_rms(y, window_length, hop_length)
 
     # Convert frame indices to time
-    times = librosa.frames_to_time(np.arange(rms.shape[1]), sr=sr, hop_length=hop_length)
+    times = frame_centre_times(rms.shape[1], hop_length / sr, min(window_length, len(y)) / sr)
 
     # Normalize RMS for color mapping
     norm = mcolors.Normalize(vmin=0, vmax=0.4)
@@ -158,13 +406,12 @@ def plot_macro_time_power_graph(file_path):
     # Plot
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.set_ylim(0., 0.4)
-    for i in range(len(times)-1):
-        ax.fill_between(times[i:i+2], 0, rms[0][i], color=cmap(norm(rms[0][i])), edgecolor='none')
+    power = power_collection(times, rms[0], hop_length / sr, cmap, norm)
+    ax.add_collection(power)
+    ax.autoscale_view()
     
     # Adding a colorbar to indicate the scale of RMS values
-    sm = cm.ScalarMappable(cmap=cmap, norm=norm)
-    sm.set_array([])
-    cbar = plt.colorbar(sm, ax=ax, label='RMS Power')
+    cbar = plt.colorbar(power, ax=ax, label='RMS Power')
     # cbar.ax.set_yticklabels([f"{x-60.0:.0f} dBFS" for x in cbar.get_ticks()])  # Adjust labels to show true dBFS values
     
     ax.set_ylabel('Power')
@@ -189,22 +436,44 @@ def find_mp3_files(directory):
     return mp3_files
 
 
-# Replace 'path/to/your/audiofile.mp3' with the path to your audio file
-file_path = []
-with open('./files.txt', 'r') as f:
-  for line in f:
-    if line[0] != '#' and line[0] != ';':
-      file_path.append(line.strip())
-
-for file in file_path:
-  max_amplitude, avg_amplitude, avg_power, avg_power_stft = analyze_track_librosa(file)
-  # read_mp3_tags(file)
-  print(f"Maximum Amplitude: {max_amplitude:.2f} dBFS")
-  print(f"Average Amplitude: {avg_amplitude:.2f} dBFS")
-  print(f"Average Power: {avg_power:.2f} dBFS")
-  print(f"Average Power (STFT): {avg_power_stft:.2f} dBFS")
-  currentsong = AudioFile(file)
-  currentsong.plot_energy_levels_over_time()
-  # plot_macro_time_power_graph(file)
-
-plt.show()
+def analyze_file(file):
+  # everything but the plotting, so it can run in a worker process;
+  # matplotlib has to stay on the main process
+  song = AudioFile(file)
+  # decode once and take the stats from the same samples the RMS uses
+  stats = analyze_signal(song.y)
+  song.get_energy_levels_over_time()
+  return stats, song
+
+
+if __name__ == '__main__':
+  # Replace 'path/to/your/audiofile.mp3' with the path to your audio file
+  file_path = []
+  with open('./files.txt', 'r') as f:
+    for line in f:
+      if line[0] != '#' and line[0] != ';':
+        file_path.append(line.strip())
+
+  # files are independent, but leave a core free for the plot windows
+  with ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) - 1)) as ex:
+    futures = [(file, ex.submit(analyze_file, file)) for file in file_path]
+    # one unreadable file shouldn't throw away everything else
+    results, failed = [], []
+    for file, future in futures:
+      try:
+        results.append(future.result())
+      except Exception as e:
+        print(f"Skipping {file}: {e}")
+        failed.append(file)
+
+  for (max_amplitude, avg_amplitude, avg_power), currentsong in results:
+    # read_mp3_tags(currentsong.file_path)
+    print(f"Maximum Amplitude: {max_amplitude:.2f} dBFS")
+    print(f"Average Amplitude: {avg_amplitude:.2f} dBFS")
+    print(f"Average Power: {avg_power:.2f} dBFS")
+    currentsong.plot_energy_levels_over_time()
+    # plot_macro_time_power_graph(currentsong.file_path)
+
+  if failed:
+    print(f"{len(failed)} of {len(file_path)} files could not be analysed")
+  plt.show()